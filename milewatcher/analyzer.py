@@ -1,83 +1,154 @@
 import google.generativeai as genai
+import functools
+import hashlib
+import json
 import os
 import logging
+import typing
+
+from milewatcher.database.database_manager import DatabaseManager
 
 logger = logging.getLogger(__name__)
 
+# Promotion searched for when no other description is given
+DEFAULT_PROMO_DESCRIPTION = "uma promoção de transferência de milhas do banco Itaú para a Latam"
+
+# Gemini model used for promotion detection
+_MODEL_NAME = 'gemini-2.0-flash-lite'
+
+@functools.lru_cache(maxsize=None)
+def _get_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """
+    Configures the Gemini SDK and builds the model once per process,
+    so every checker instance shares the same client.
+    """
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+class _PromotionCheckResult(typing.TypedDict):
+    """
+    Schema of the result of a single post in the Gemini JSON response.
+    """
+    post: int
+    is_promo: bool
+    summary: str
+
 class MileagePromotionChecker:
     """
     A class to check for mileage transfer promotions within text content using
     the Google Gemini API.
     """
 
-    def __init__(self):
+    # Makes Gemini answer with a JSON array holding one result object per post,
+    # instead of free text that would need to be parsed line by line
+    _GENERATION_CONFIG = genai.GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=list[_PromotionCheckResult]
+    )
+
+    # How long a cached promotion check result is considered valid
+    _CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+    def __init__(self, db_manager: DatabaseManager = None):
         """
         Initializes the MileagePromotionChecker with a Gemini model and API key.
+
+        Args:
+            db_manager (DatabaseManager): Optional database manager used to cache results,
+                                          so identical texts are not sent to Gemini twice.
         """
+        self._db_manager = db_manager
         self._api_key = os.getenv('GOOGLE_API_KEY')
         if not self._api_key:
             raise ValueError("Google Gemini API key not found. Please provide it or set the 'GOOGLE_API_KEY' environment variable.")
 
-        genai.configure(api_key=self._api_key)
-        self._model = genai.GenerativeModel('gemini-2.0-flash-lite')
+        self._model = _get_model(self._api_key, _MODEL_NAME)
+        if self._db_manager:
+            # Expired results are never served, so they are dropped to keep the cache bounded
+            self._db_manager.delete_expired_promotion_checks(self._CACHE_TTL_SECONDS)
         logger.debug(f"MileagePromotionCheck successfully configured")
 
-    def _build_promo_detection_prompt(self, text_content: str, promo_description: str) -> str:
+    def _build_promo_detection_prompt(self, texts: list[str], promo_description: str) -> str:
         """
         Constructs the prompt to be sent to the Gemini model for promotion detection
-        with a customizable promotion description.
+        with a customizable promotion description. Several texts are analyzed in a
+        single prompt, each one delimited by a numbered header.
 
         Args:
-            text_content (str): The text content to be analyzed.
+            texts (list[str]): The text contents to be analyzed.
             promo_description (str): A description of the promotion to search for.
 
         Returns:
             str: The formatted prompt.
         """
+        posts_block = "\n".join(
+            f"=== POST {index} ===\n{text_content}" for index, text_content in enumerate(texts, start=1)
+        )
         # --- Gemini Prompt (Portuguese as requested, now with dynamic promotion description) ---
         prompt = f"""
-Analise o seguinte conteúdo de texto e identifique se ele contém informações sobre: {promo_description}.
+Analise cada um dos {len(texts)} conteúdos de texto a seguir e identifique, para cada um, se ele contém informações sobre: {promo_description}.
 Por favor, retorne TRUE se houver tal promoção e FALSE caso contrário.
 Se a promoção for encontrada, forneça também um breve sumário dos principais detalhes da promoção (por exemplo, período da promoção, bônus percentual, condições).
 
-Conteúdo do texto:
----
-{text_content}
----
+Conteúdos de texto:
+{posts_block}
+=== FIM ===
 
-Formato da resposta esperado:
-Booleano: [TRUE/FALSE]
-Sumário: [Sumário da promoção, se TRUE. Caso contrário, 'N/A']
+Responda com um objeto por post, na mesma ordem, contendo o número do post em "post",
+true ou false em "is_promo" e em "summary" o sumário da promoção, se true. Caso contrário, 'N/A'.
         """
         logger.debug(f"Generated prompt: {prompt[:200]}...") # Log first 200 chars for brevity
         return prompt
 
-    def _parse_gemini_response(self, gemini_raw_response: str) -> tuple[bool, str]:
+    def _parse_gemini_response(self, gemini_raw_response: str, expected_count: int) -> list[tuple[bool, str] | None]:
         """
-        Processes the raw text response from Gemini and extracts the boolean and summary.
+        Processes the raw JSON response from Gemini and extracts the boolean and summary
+        of each analyzed post.
 
         Args:
-            gemini_raw_response (str): The raw text response from the Gemini model.
+            gemini_raw_response (str): The raw JSON response from the Gemini model.
+            expected_count (int): The number of posts sent in the prompt.
 
         Returns:
-            tuple: (bool, str) - Boolean indicating if the promotion was found and the summary.
+            list: One (bool, str) tuple per post, in prompt order, with the boolean indicating
+                  if the promotion was found and the summary. None for posts missing in the response.
         """
         logger.debug(f"Parsing Gemini raw response: {gemini_raw_response.strip()[:200]}...")
-        is_promo = False
-        summary = "N/A"
-
-        lines = gemini_raw_response.split('\n')
-        for line in lines:
-            if line.startswith("Booleano:"):
-                is_promo_str = line.split(":", 1)[1].strip().upper()
-                is_promo = (is_promo_str == "TRUE")
-                logger.debug(f"Parsed boolean: {is_promo_str} -> {is_promo}")
-            elif line.startswith("Sumário:"):
-                summary = line.split(":", 1)[1].strip()
-                logger.debug(f"Parsed summary: '{summary}'")
-        return is_promo, summary
-
-    def check_promotion(self, text_content: str, promo_description: str = "uma promoção de transferência de milhas do banco Itaú para a Latam") -> tuple[bool, str]:
+        results = [None] * expected_count
+
+        try:
+            entries = json.loads(gemini_raw_response)
+        except json.JSONDecodeError as e:
+            logger.error(f"Gemini response is not valid JSON: {e}")
+            return results
+
+        for entry in entries if isinstance(entries, list) else []:
+            try:
+                index = int(entry['post']) - 1
+                is_promo = bool(entry['is_promo'])
+                summary = str(entry.get('summary', 'N/A'))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                logger.warning(f"Ignoring malformed entry in Gemini response: {entry}")
+                continue
+
+            if not 0 <= index < expected_count:
+                continue
+
+            logger.debug(f"Parsed post {index + 1}: {is_promo}, '{summary}'")
+            results[index] = (is_promo, summary)
+        return results
+
+    @staticmethod
+    def _build_cache_key(text_content: str, promo_description: str) -> str:
+        """
+        Builds the cache key for a promotion check from its inputs.
+
+        Returns:
+            str: The SHA-256 hex digest of the promotion description and the text content.
+        """
+        return hashlib.sha256(f"{promo_description}\n{text_content}".encode('utf-8')).hexdigest()
+
+    def check_promotion(self, text_content: str, promo_description: str = DEFAULT_PROMO_DESCRIPTION) -> tuple[bool, str]:
         """
         Checks for a specific promotion within a given text content using the Gemini model.
 
@@ -88,38 +159,92 @@ Sumário: [Sumário da promoção, se TRUE. Caso contrário, 'N/A']
 
         Returns:
             tuple: (bool, str) - A boolean indicating if the promotion was found and a summary of the promotion.
+                   (False, "N/A") if the text is missing from the Gemini response.
+        """
+        try:
+            result = self.check_promotions([text_content], promo_description)[0]
+            return result if result else (False, "N/A")
+        except Exception as e:
+            logger.exception(f"An unexpected error occurred during promotion check: {e}")
+            return False, f"An error occurred: {e}"
+
+    def check_promotions(self, texts: list[str], promo_description: str = DEFAULT_PROMO_DESCRIPTION) -> list[tuple[bool, str] | None]:
+        """
+        Checks for a specific promotion within several text contents using a single
+        Gemini request. Keep the number of texts small enough to fit the model context window.
+
+        Args:
+            texts (list[str]): The text strings to be analyzed.
+            promo_description (str): A description of the promotion to search for.
+                                     Defaults to "uma promoção de transferência de milhas do banco Itaú para a Latam".
+
+        Returns:
+            list: One (bool, str) tuple per text, in the same order, with a boolean indicating
+                  if the promotion was found and a summary of the promotion. None for texts
+                  missing in the Gemini response.
+
+        Raises:
+            Exception: Any error raised while calling the Gemini API.
         """
-        logger.info("Starting promotion check.")
+        logger.info(f"Starting promotion check for {len(texts)} text(s).")
         if not self._model:
             logger.error("Gemini model is not initialized. API configuration might have failed earlier.")
-            return False, "Gemini model not initialized. API configuration failed."
+            raise RuntimeError("Gemini model not initialized. API configuration failed.")
 
-        try:
-            # Build the prompt with the dynamic promotion description
-            prompt = self._build_promo_detection_prompt(text_content, promo_description)
+        results = [None] * len(texts)
+        cache_keys = [None] * len(texts)
+        if self._db_manager:
+            for index, text_content in enumerate(texts):
+                cache_keys[index] = self._build_cache_key(text_content, promo_description)
+                results[index] = self._db_manager.get_cached_promotion_check(cache_keys[index], self._CACHE_TTL_SECONDS)
+                if results[index]:
+                    logger.info(f"Promotion check served from cache. Found: {results[index][0]}, Summary: '{results[index][1]}'")
+
+        # Only texts without a cached result are sent to Gemini
+        pending = [index for index, result in enumerate(results) if result is None]
+        if not pending:
+            return results
 
-            # Count tokens before generating the response
+        # Build the prompt with the dynamic promotion description
+        prompt = self._build_promo_detection_prompt([texts[index] for index in pending], promo_description)
+
+        # Estimate tokens locally (~4 characters per token) to avoid an extra API round trip.
+        # The exact count can still be requested from the API for debugging purposes.
+        if os.getenv('GEMINI_COUNT_TOKENS'):
             try:
                 token_count_response = self._model.count_tokens(prompt)
                 logger.info(f"Tokens in prompt: {token_count_response.total_tokens}")
             except Exception as e:
                 logger.warning(f"Error counting tokens: {e}")
+        else:
+            logger.debug(f"Estimated tokens in prompt: {len(prompt) // 4}")
+
+        logger.info("Calling Gemini API to generate content.")
+        # Call the Gemini API
+        gemini_response = self._model.generate_content(prompt, generation_config=self._GENERATION_CONFIG)
+        text_response = gemini_response.text
+
+        # The response already reports how many tokens the prompt used
+        usage_metadata = getattr(gemini_response, 'usage_metadata', None)
+        if usage_metadata:
+            logger.info(f"Tokens in prompt: {usage_metadata.prompt_token_count}")
+        logger.debug(f"Raw Gemini response received: {text_response.strip()[:200]}...")
 
-            logger.info("Calling Gemini API to generate content.")
-            # Call the Gemini API
-            gemini_response = self._model.generate_content(prompt)
-            text_response = gemini_response.text
-            logger.debug(f"Raw Gemini response received: {text_response.strip()[:200]}...")
+        # Process the response
+        parsed_results = self._parse_gemini_response(text_response, len(pending))
+        for index, parsed_result in zip(pending, parsed_results):
+            if parsed_result is None:
+                logger.warning(f"Gemini response did not include a result for text {index + 1}.")
+                continue
 
-            # Process the response
-            is_promo, summary = self._parse_gemini_response(text_response)
+            is_promo, summary = parsed_result
             logger.info(f"Promotion check completed. Found: {is_promo}, Summary: '{summary}'")
+            results[index] = parsed_result
 
-            return is_promo, summary
+            if cache_keys[index]:
+                self._db_manager.cache_promotion_check(cache_keys[index], is_promo, summary)
 
-        except Exception as e:
-            logger.exception(f"An unexpected error occurred during promotion check: {e}")
-            return False, f"An error occurred: {e}"
+        return results
 
 # --- Main Execution Block ---
 if __name__ == "__main__":
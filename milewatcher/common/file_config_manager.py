@@ -14,6 +14,11 @@ class FileConfigManager:
     Manages file paths within the configuration directory, ensuring parent
     directories exist before file operations.
     """
+
+    # Directories already ensured to exist, shared by all instances since callers
+    # usually create a new manager for each lookup
+    _known_dirs: set[str] = set()
+
     def __init__(self):
         """
         Initializes the FileConfigManager with a base directory.
@@ -25,13 +30,16 @@ class FileConfigManager:
     def _ensure_directory_exists(self, dir_path: str):
         """
         Ensures that the given directory exists. Creates it if it does not.
+        Directories already ensured by any instance are not checked again.
 
         Args:
             dir_path (str): The path to the directory.
         """
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path, exist_ok=True)
-            logger.info(f"Created directory: '{dir_path}'")
+        if dir_path in self._known_dirs:
+            return
+        os.makedirs(dir_path, exist_ok=True)
+        self._known_dirs.add(dir_path)
+        logger.debug(f"Ensured directory exists: '{dir_path}'")
 
     def get_file_path(self, relative_path: str) -> str:
         """
@@ -1,61 +1,74 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 
-class AppLogger:
+# Define the common base formatter string here
+# This is the part that both console and file formatters will share.
+_BASE_FORMAT_STRING = '%(asctime)s [%(levelname)s] [%(name)s] %(message)s'
+
+# Number of records buffered in memory before they are written to the log file
+_FILE_BUFFER_CAPACITY = 512
+
+_queue_listener = None # Background thread writing the records to the handlers
+
+def configure_logging():
     """
-    A class to encapsulate the logging configuration for the application.
+    Configures the root logger with specific handlers and formatters.
+    Modules log through 'logging.getLogger(__name__)'; this only needs to be called
+    once, at application startup. Subsequent calls have no effect.
+
+    The root logger only puts records on a queue; a QueueListener thread
+    hands them to the actual handlers, so logging calls never block on I/O.
+    Sets up:
+    - StreamHandler (console) for INFO level and above.
+    - FileHandler (/tmp/milewatcher.log) for DEBUG level and above, behind a
+      MemoryHandler so records are written in batches instead of one by one.
     """
-    _logger_instance = None # To hold the configured logger
-
-    # Define the common base formatter string here
-    # This is the part that both console and file formatters will share.
-    _BASE_FORMAT_STRING = '%(asctime)s [%(levelname)s] [%(name)s] %(message)s'
-
-    @classmethod
-    def setup_logging(cls):
-        """
-        Configures the root logger with specific handlers and formatters.
-        Sets up:
-        - StreamHandler (console) for INFO level and above.
-        - FileHandler (app_log.log) for DEBUG level and above.
-        """
-        if cls._logger_instance is not None:
-            # Logger already configured, return existing instance
-            return cls._logger_instance
-
-        logger = logging.getLogger()
-        logger.setLevel(logging.DEBUG) # Lowest level for the logger to process all messages
-
-        if logger.hasHandlers():
-            logger.handlers.clear()
-
-        # --- Define Formatters ---
-        console_formatter = logging.Formatter(cls._BASE_FORMAT_STRING)
-        file_formatter = logging.Formatter(cls._BASE_FORMAT_STRING)
-
-
-        # --- Configure Console Handler ---
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(logging.INFO) # Console shows INFO, WARNING, ERROR, CRITICAL
-        console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
-
-        # --- Configure File Handler ---
-        file_handler = logging.FileHandler('/tmp/milewatcher.log')
-        file_handler.setLevel(logging.DEBUG) # File captures all levels (DEBUG, INFO, etc.)
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
-
-        cls._logger_instance = logger # Store the configured logger
-
-        return logger
-
-    @classmethod
-    def get_logger(cls, name=None):
-        """
-        Returns a logger instance. Call setup_logging() first to configure.
-        If setup_logging() hasn't been called, it will call it.
-        """
-        if cls._logger_instance is None:
-            cls.setup_logging()
-        return logging.getLogger(name)
+    global _queue_listener
+    if _queue_listener is not None:
+        # Logging already configured
+        return
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG) # Lowest level for the logger to process all messages
+
+    if logger.hasHandlers():
+        logger.handlers.clear()
+
+    # --- Define Formatters ---
+    console_formatter = logging.Formatter(_BASE_FORMAT_STRING)
+    file_formatter = logging.Formatter(_BASE_FORMAT_STRING)
+
+
+    # --- Configure Console Handler ---
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO) # Console shows INFO, WARNING, ERROR, CRITICAL
+    console_handler.setFormatter(console_formatter)
+
+    # --- Configure File Handler ---
+    # The file is only opened when the first record is written
+    file_handler = logging.FileHandler('/tmp/milewatcher.log', mode='a', encoding='utf-8', delay=True)
+    file_handler.setLevel(logging.DEBUG) # File captures all levels (DEBUG, INFO, etc.)
+    file_handler.setFormatter(file_formatter)
+
+    # Records are flushed once the buffer is full, on ERROR and above, and at exit
+    buffered_file_handler = logging.handlers.MemoryHandler(
+        capacity=_FILE_BUFFER_CAPACITY,
+        flushLevel=logging.ERROR,
+        target=file_handler,
+        flushOnClose=True
+    )
+    buffered_file_handler.setLevel(logging.DEBUG)
+    atexit.register(buffered_file_handler.close)
+
+    # --- Configure Queue ---
+    log_queue = queue.Queue(-1) # Unbounded, so producers never wait
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _queue_listener = logging.handlers.QueueListener(
+        log_queue, console_handler, buffered_file_handler, respect_handler_level=True
+    )
+    _queue_listener.start()
+    # Registered after the file handler's close, so it runs first and drains the queue
+    atexit.register(_queue_listener.stop)
@@ -1,33 +1,142 @@
+import atexit
+import functools
 import logging
 import sqlite3
-from datetime import datetime
+import threading
 from enum import Enum
+from typing import Iterator
 from milewatcher.common.file_config_manager import FileConfigManager
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
+# Statements run on every call are kept as constants, so their text, and therefore
+# their entry in the connection's prepared statement cache, is always the same
+_SQL_SELECT_SOURCE_ID = "SELECT id FROM sources WHERE name = ?"
+_SQL_INSERT_SOURCE = "INSERT INTO sources (name) VALUES (?)"
+# The no-op update makes RETURNING report the ID of an already existing source too
+_SQL_UPSERT_SOURCE = "INSERT INTO sources (name) VALUES (?) ON CONFLICT(name) DO UPDATE SET name = excluded.name RETURNING id"
+_SQL_INSERT_POST = "INSERT INTO posts (source_id, title, link) VALUES (?, ?, ?) ON CONFLICT(link) DO NOTHING"
+# Number of posts looked up or written by a single multi-row statement, well below
+# the 999 bound parameters older SQLite versions allow per statement
+_INSERT_POSTS_CHUNK_SIZE = 100
+# Full chunks of links share this statement; only the last, shorter one needs its own
+_SQL_SELECT_EXISTING_LINKS = "SELECT link FROM posts WHERE link IN ({})"
+_SQL_SELECT_EXISTING_LINKS_CHUNK = _SQL_SELECT_EXISTING_LINKS.format(", ".join(["?"] * _INSERT_POSTS_CHUNK_SIZE))
+_SQL_INSERT_POSTS_CHUNK = (
+    "INSERT INTO posts (source_id, title, link) VALUES "
+    + ", ".join(["(?, ?, ?)"] * _INSERT_POSTS_CHUNK_SIZE)
+    + " ON CONFLICT(link) DO NOTHING"
+)
+# The processing time is filled in by SQLite (UTC, like the other timestamp columns)
+_SQL_UPDATE_POST_STATE = "UPDATE posts SET state = ?, processed_at = strftime('%Y-%m-%dT%H:%M:%f', 'now') WHERE id = ?"
+# A failed analysis is counted; the post is given up on (set to ERROR) once it reaches the maximum
+# number of attempts, otherwise it stays in its current state to be retried on the next run
+_SQL_RECORD_FAILED_ANALYSIS = """
+    UPDATE posts SET
+        analysis_attempts = analysis_attempts + 1,
+        state = CASE WHEN analysis_attempts + 1 >= :max_attempts THEN 'ERROR' ELSE state END,
+        processed_at = CASE WHEN analysis_attempts + 1 >= :max_attempts
+                            THEN strftime('%Y-%m-%dT%H:%M:%f', 'now') ELSE processed_at END
+    WHERE id = :post_id
+"""
+_SQL_COUNT_ERROR_POSTS = "SELECT COUNT(*) FROM posts WHERE state = 'ERROR' AND id IN ({})"
+# A negative LIMIT means no limit in SQLite
+_SQL_SELECT_UNPROCESSED_POSTS = "SELECT id, link FROM posts WHERE state = 'UNPROCESSED' LIMIT ?"
+_SQL_SELECT_UNPROCESSED_POSTS_BY_SOURCE = "SELECT id, link FROM posts WHERE state = 'UNPROCESSED' AND source_id = ? LIMIT ?"
+_SQL_SELECT_CACHED_PROMOTION_CHECK = "SELECT is_promo, summary FROM llm_cache WHERE key = ? AND created_at >= datetime('now', ?)"
+_SQL_DELETE_EXPIRED_PROMOTION_CHECKS = "DELETE FROM llm_cache WHERE created_at < datetime('now', ?)"
+_SQL_INSERT_PROMOTION_CHECK = "INSERT OR REPLACE INTO llm_cache (key, is_promo, summary) VALUES (?, ?, ?)"
+
+def _synchronized(method):
+    """
+    Decorator serializing calls to a DatabaseManager method through the instance lock,
+    since the shared connection must not be used by two threads at the same time.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class DatabaseManager:
     """
     Manages all SQLite database operations for sources and posts.
     """
+
+    # Number of prepared statements kept by the connection (sqlite3 defaults to 128)
+    _CACHED_STATEMENTS = 256
+
+    # Number of rows fetched at a time when streaming query results
+    _FETCH_BATCH_SIZE = 100
+
+    # Whether the SQLite library supports the RETURNING clause (added in 3.35.0)
+    _SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
     def __init__(self):
         self._db_name = FileConfigManager().get_file_path('database.db') 
+        # A single connection is kept open for the lifetime of the manager, so
+        # connection setup and PRAGMAs are paid for only once.
+        # It may be used from worker threads, so access to it goes through a lock.
+        self._lock = threading.RLock()
+        self._conn = self._get_connection()
+        # Source IDs never change once created, so each one is looked up only once
+        self._source_id_cache: dict[str, int] = {}
+        # Make sure pending WAL content is checkpointed and the file is released on exit
+        atexit.register(self.close)
         self._create_database_and_tables()
 
     def _get_connection(self):
-        """Helper to get a database connection."""
-        return sqlite3.connect(self._db_name)
+        """
+        Helper to get a database connection tuned for this workload.
+        """
+        conn = sqlite3.connect(self._db_name, check_same_thread=False, cached_statements=self._CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row # Rows can be accessed by column name
+        self._configure_pragmas(conn)
+        return conn
+
+    @staticmethod
+    def _configure_pragmas(conn: sqlite3.Connection):
+        """
+        Applies the connection PRAGMAs: WAL journaling with relaxed fsync behaviour
+        (safe under WAL), in-memory temp storage, a larger page cache and a busy
+        timeout so concurrent writers wait instead of failing.
+
+        Note that in WAL mode SQLite keeps 'database.db-wal' and 'database.db-shm'
+        sidecar files next to the database; they are part of it and must be kept
+        (or copied) together with 'database.db'.
+        """
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-64000; -- Negative value is in KiB (~64MB)
+            PRAGMA busy_timeout=5000;
+        """)
+
+    @_synchronized
+    def close(self):
+        """
+        Refreshes the query planner statistics if needed and closes the database
+        connection. The manager cannot be used afterwards.
+        """
+        if self._conn:
+            try:
+                # Only re-analyzes tables whose statistics are likely out of date
+                self._conn.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                logger.warning(f"Database error optimizing '{self._db_name}' on close: {e}")
+            self._conn.close()
+            self._conn = None
+            logger.debug("Database connection to '%s' closed.", self._db_name)
 
     def _create_database_and_tables(self):
         """
         Creates an SQLite database and tables to store source information,
         post titles, and links, designed for multiple sources.
         """
-        conn = None
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            cursor = self._conn.cursor()
 
             # Create sources table
             cursor.execute('''
@@ -47,83 +156,128 @@ class DatabaseManager:
                         link TEXT UNIQUE NOT NULL,
                         extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         processed_at TIMESTAMP,
+                        analysis_attempts INTEGER DEFAULT 0 NOT NULL,
                         state TEXT DEFAULT 'UNPROCESSED' NOT NULL CHECK(state IN ('UNPROCESSED', 'RELEVANT', 'NOT_RELEVANT', 'ERROR')),
                         FOREIGN KEY (source_id) REFERENCES sources(id)
                     )
                 ''')
-            conn.commit()
-            logger.debug(f"Database '{self._db_name}' and tables 'sources' and 'posts' ensured to exist.")
+
+            # Index for the lookup of posts waiting for content processing, by state and source.
+            # It supersedes the former partial index on unprocessed posts.
+            # Databases created before the failed analyses were counted lack the column
+            cursor.execute("PRAGMA table_info(posts)")
+            if 'analysis_attempts' not in {column['name'] for column in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE posts ADD COLUMN analysis_attempts INTEGER DEFAULT 0 NOT NULL")
+
+            cursor.execute("DROP INDEX IF EXISTS idx_posts_unprocessed")
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_posts_state_source'")
+            index_created = cursor.fetchone() is None
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_state_source ON posts(state, source_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_source ON posts(source_id)")
+
+            # Create cache table for promotion check results, keyed by a hash of the analyzed input
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    is_promo INTEGER NOT NULL,
+                    summary TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            self._conn.commit()
+
+            # Gather the statistics the query planner uses to choose between indexes once, when the
+            # index is created; afterwards they are kept up to date by 'PRAGMA optimize' on close
+            if index_created:
+                cursor.execute("ANALYZE")
+            logger.debug("Database '%s' and tables 'sources', 'posts' and 'llm_cache' ensured to exist.", self._db_name)
         except sqlite3.Error as e:
             logger.error(f"Database error during table creation: {e}", exc_info=True)
-        finally:
-            if conn:
-                conn.close()
 
+    @_synchronized
     def get_or_create_source_id(self, source_name: str) -> int:
         """
         Retrieves the ID of an existing source or creates a new one if it doesn't exist.
         Returns the source ID.
         """
-        conn = None
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+        if source_name in self._source_id_cache:
+            return self._source_id_cache[source_name]
 
-            # Try to get existing source ID
-            cursor.execute("SELECT id FROM sources WHERE name = ?", (source_name,))
-            result = cursor.fetchone()
+        try:
+            cursor = self._conn.cursor()
 
-            if result:
-                logger.debug(f"Source '{source_name}' already exists with ID: {result[0]}.")
-                return result[0]
+            if self._SUPPORTS_RETURNING:
+                # Get or create the source in a single statement
+                with self._conn:
+                    source_id = cursor.execute(_SQL_UPSERT_SOURCE, (source_name,)).fetchone()[0]
+                logger.debug("Source '%s' resolved to ID: %s.", source_name, source_id)
             else:
-                # If source does not exist, insert it
-                cursor.execute("INSERT INTO sources (name) VALUES (?)", (source_name,))
-                conn.commit()
-                source_id = cursor.lastrowid
-                logger.debug(f"New source '{source_name}' added to the database with ID: {source_id}.")
-                return source_id
+                # Try to get existing source ID
+                cursor.execute(_SQL_SELECT_SOURCE_ID, (source_name,))
+                result = cursor.fetchone()
+
+                if result:
+                    source_id = result[0]
+                    logger.debug("Source '%s' already exists with ID: %s.", source_name, source_id)
+                else:
+                    # If source does not exist, insert it
+                    with self._conn:
+                        cursor.execute(_SQL_INSERT_SOURCE, (source_name,))
+                    source_id = cursor.lastrowid
+                    logger.debug("New source '%s' added to the database with ID: %s.", source_name, source_id)
+
+            self._source_id_cache[source_name] = source_id
+            return source_id
         except sqlite3.Error as e:
             logger.error(f"Database error getting/creating source '{source_name}': {e}", exc_info=True)
             return -1 # Indicate an error
-        finally:
-            if conn:
-                conn.close()
 
+    @_synchronized
     def insert_posts(self, source_id: int, posts: list[dict]) -> int:
         """
         Inserts a list of posts into the SQLite database, associating them with a source ID.
         Handles duplicate links by ignoring them.
-        New posts are inserted with is_processed = 0 (false).
+        New posts are inserted in the 'UNPROCESSED' state.
+
+        Links already in the database are filtered out first, with one lookup per chunk of
+        links, since after the first run most of the scraped posts are known. The new posts are written in
+        multi-row INSERT statements of a fixed size, the remaining ones in a single batch,
+        and everything is committed in one transaction.
 
         Returns the number of posts inserted.
         """
-        conn = None
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            cursor = self._conn.cursor()
+            links = [post['link'] for post in posts]
+            existing_links = set()
+            for start in range(0, len(links), _INSERT_POSTS_CHUNK_SIZE):
+                chunk = links[start:start + _INSERT_POSTS_CHUNK_SIZE]
+                if len(chunk) == _INSERT_POSTS_CHUNK_SIZE:
+                    cursor.execute(_SQL_SELECT_EXISTING_LINKS_CHUNK, chunk)
+                else:
+                    cursor.execute(_SQL_SELECT_EXISTING_LINKS.format(", ".join(["?"] * len(chunk))), chunk)
+                existing_links.update(link for link, in cursor)
+
+            rows = [(source_id, post['title'], post['link']) for post in posts if post['link'] not in existing_links]
+            full_chunks_end = len(rows) - len(rows) % _INSERT_POSTS_CHUNK_SIZE
             inserted_count = 0
-            skipped_count = 0
-            for post in posts:
-                try:
-                    cursor.execute(
-                        "INSERT INTO posts (source_id, title, link) VALUES (?, ?, ?)",
-                        (source_id, post['title'], post['link'])
-                    )
-                    inserted_count += 1
-                except sqlite3.IntegrityError:
-                    skipped_count += 1
-                except Exception as e:
-                    logger.error(f"Error inserting post {post['link']}: {e}", exc_info=True)
-            conn.commit()
-            logger.debug(f"Skipped {skipped_count} posts and inserted {inserted_count} new posts into '{self._db_name}'.")
+            with self._conn:
+                # Links inserted since the lookup, or repeated within the batch, are skipped by the
+                # conflict clause; any other constraint violation still fails the batch.
+                for start in range(0, full_chunks_end, _INSERT_POSTS_CHUNK_SIZE):
+                    chunk = rows[start:start + _INSERT_POSTS_CHUNK_SIZE]
+                    cursor.execute(_SQL_INSERT_POSTS_CHUNK, [value for row in chunk for value in row])
+                    inserted_count += max(cursor.rowcount, 0)
+
+                if full_chunks_end < len(rows):
+                    cursor.executemany(_SQL_INSERT_POST, rows[full_chunks_end:])
+                    inserted_count += max(cursor.rowcount, 0)
+            skipped_count = len(posts) - inserted_count
+            logger.debug("Skipped %s posts and inserted %s new posts into '%s'.", skipped_count, inserted_count, self._db_name)
             return inserted_count
         except sqlite3.Error as e:
             logger.error(f"Database error during post insertion: {e}", exc_info=True)
             return 0
-        finally:
-            if conn:
-                conn.close()
 
     class PostState(Enum):
         UNPROCESSED = "UNPROCESSED"
@@ -131,6 +285,7 @@ class DatabaseManager:
         NOT_RELEVANT = "NOT_RELEVANT"
         ERROR = "ERROR"
 
+    @_synchronized
     def update_post_state(self, post_id: int, state: PostState):
         """
         Sets a post's 'state' and records the 'processed_at' timestamp
@@ -142,70 +297,159 @@ class DatabaseManager:
             logger.error(f"Invalid state, must be a PostState enum member.")
             return
 
-        conn = None
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            current_timestamp = datetime.now().isoformat()
-
-            cursor.execute(
-                """
-                UPDATE posts
-                SET state = ?,
-                    processed_at = ?
-                WHERE id = ?
-                """,
-                (state.value, current_timestamp, post_id)
-            )
-            conn.commit()
+            cursor = self._conn.cursor()
+
+            with self._conn:
+                cursor.execute(_SQL_UPDATE_POST_STATE, (state.value, post_id))
             if cursor.rowcount > 0:
-                logger.debug(f"Post ID {post_id} state updated to: '{state.value}' at {current_timestamp}.")
+                logger.debug("Post ID %s state updated to: '%s'.", post_id, state.value)
             else:
                 logger.warning(f"Post ID {post_id} not found to update state.")
         except sqlite3.Error as e:
             logger.error(f"Database error updating state for post ID {post_id}: {e}", exc_info=True)
-        finally:
-            if conn:
-                conn.close()
 
-    def get_posts_for_content_processing(self, source_id: int = None, limit: int = -1) -> list[dict]:
+    @_synchronized
+    def update_posts_state(self, updates: list[tuple[int, PostState]]) -> int:
         """
-        Retrieves posts that have not yet had their content processed.
-        Returns a list of dictionaries, where each dictionary contains 'id' and 'link'.
+        Sets the 'state' of several posts at once, recording the 'processed_at'
+        timestamp of each one. All updates are committed in a single transaction.
+
+        Args:
+            updates (list[tuple[int, PostState]]): Pairs of (post_id, state).
+
+        Returns the number of posts updated.
         """
-        conn = None
-        posts_to_process = []
+        if any(not isinstance(state, self.PostState) for _, state in updates):
+            logger.error("Invalid state, must be a PostState enum member.")
+            return 0
+
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            query = """
-                SELECT id, link
-                FROM posts
-                WHERE state IS 'UNPROCESSED'
-            """
-            params = []
-            if source_id is not None:
-                query += " AND source_id = ?"
-                params.append(source_id)
-
-            if limit > 0:
-                query += f" LIMIT {limit}"
-
-            cursor.execute(query, tuple(params))
-            rows = cursor.fetchall()
-
-            for row in rows:
-                # --- CORREÇÃO APLICADA AQUI: Acessando por índice numérico ---
-                posts_to_process.append({
-                    'id': row[0],  # 'id' é a primeira coluna na SELECT (índice 0)
-                    'link': row[1] # 'link' é a segunda coluna na SELECT (índice 1)
-                })
-            logger.debug(f"Retrieved {len(posts_to_process)} posts requiring relevance assessment (id and link only).")
-            return posts_to_process
+            cursor = self._conn.cursor()
+
+            with self._conn:
+                cursor.executemany(
+                    _SQL_UPDATE_POST_STATE,
+                    [(state.value, post_id) for post_id, state in updates]
+                )
+            updated_count = max(cursor.rowcount, 0)
+            if updated_count < len(updates):
+                logger.warning(f"Only {updated_count} of {len(updates)} posts were found to update state.")
+            logger.debug("Updated state of %s posts.", updated_count)
+            return updated_count
+        except sqlite3.Error as e:
+            logger.error(f"Database error updating state for {len(updates)} posts: {e}", exc_info=True)
+            return 0
+
+    @_synchronized
+    def record_failed_analyses(self, post_ids: list[int], max_attempts: int) -> int:
+        """
+        Counts a failed content analysis for each of the given posts. Posts that have now
+        failed 'max_attempts' times are set to 'ERROR', recording the 'processed_at'
+        timestamp; the others keep their state, so they are analyzed again on the next run.
+        All updates are committed in a single transaction.
+
+        Returns the number of posts set to 'ERROR'.
+        """
+        try:
+            cursor = self._conn.cursor()
+
+            with self._conn:
+                cursor.executemany(
+                    _SQL_RECORD_FAILED_ANALYSIS,
+                    [{'post_id': post_id, 'max_attempts': max_attempts} for post_id in post_ids]
+                )
+                given_up_count = 0
+                for start in range(0, len(post_ids), _INSERT_POSTS_CHUNK_SIZE):
+                    chunk = post_ids[start:start + _INSERT_POSTS_CHUNK_SIZE]
+                    cursor.execute(_SQL_COUNT_ERROR_POSTS.format(", ".join(["?"] * len(chunk))), chunk)
+                    given_up_count += cursor.fetchone()[0]
+            logger.debug("Recorded a failed analysis for %s posts, %s of them set to 'ERROR'.", len(post_ids), given_up_count)
+            return given_up_count
+        except sqlite3.Error as e:
+            logger.error(f"Database error recording failed analyses for {len(post_ids)} posts: {e}", exc_info=True)
+            return 0
+
+    def iter_posts_for_content_processing(self, source_id: int = None, limit: int = -1) -> Iterator[sqlite3.Row]:
+        """
+        Yields the posts that have not yet had their content processed, as they are read
+        from the database, so the whole result never has to be held in memory.
+        Each row contains 'id' and 'link', accessible by name or by unpacking.
+
+        Rows are fetched in batches, holding the lock only while each batch is read, so
+        the connection can be used by other threads while the posts are being consumed.
+        """
+        try:
+            with self._lock:
+                cursor = self._conn.cursor()
+                limit = limit if limit > 0 else -1
+                if source_id is not None:
+                    cursor.execute(_SQL_SELECT_UNPROCESSED_POSTS_BY_SOURCE, (source_id, limit))
+                else:
+                    cursor.execute(_SQL_SELECT_UNPROCESSED_POSTS, (limit,))
+
+            retrieved_count = 0
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(self._FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                retrieved_count += len(rows)
+                yield from rows
+            logger.debug("Retrieved %s posts requiring relevance assessment (id and link only).", retrieved_count)
         except sqlite3.Error as e:
             logger.error(f"Database error retrieving posts for relevance assessment: {e}", exc_info=True)
-            return []
-        finally:
-            if conn:
-                conn.close()
+
+    def get_posts_for_content_processing(self, source_id: int = None, limit: int = -1) -> list[sqlite3.Row]:
+        """
+        Retrieves posts that have not yet had their content processed.
+        Returns a list of rows, where each row contains 'id' and 'link' accessible by name.
+        """
+        return list(self.iter_posts_for_content_processing(source_id, limit))
+
+    @_synchronized
+    def get_cached_promotion_check(self, key: str, max_age_seconds: int) -> tuple[bool, str] | None:
+        """
+        Retrieves a cached promotion check result, ignoring entries older than 'max_age_seconds'.
+        Returns a tuple (is_promo, summary), or None if there is no valid entry.
+        """
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute(_SQL_SELECT_CACHED_PROMOTION_CHECK, (key, f"-{max_age_seconds} seconds"))
+            result = cursor.fetchone()
+            if result:
+                logger.debug("Cache hit for promotion check with key: %s.", key)
+                return bool(result['is_promo']), result['summary']
+            return None
+        except sqlite3.Error as e:
+            logger.error(f"Database error reading promotion check cache for key {key}: {e}", exc_info=True)
+            return None
+
+    @_synchronized
+    def cache_promotion_check(self, key: str, is_promo: bool, summary: str):
+        """
+        Stores a promotion check result in the cache, replacing any previous entry for the key.
+        """
+        try:
+            with self._conn:
+                self._conn.execute(_SQL_INSERT_PROMOTION_CHECK, (key, int(is_promo), summary))
+            logger.debug("Promotion check result cached with key: %s.", key)
+        except sqlite3.Error as e:
+            logger.error(f"Database error caching promotion check for key {key}: {e}", exc_info=True)
+
+    @_synchronized
+    def delete_expired_promotion_checks(self, max_age_seconds: int) -> int:
+        """
+        Deletes the cached promotion check results older than 'max_age_seconds'.
+        Returns the number of entries deleted.
+        """
+        try:
+            cursor = self._conn.cursor()
+            with self._conn:
+                cursor.execute(_SQL_DELETE_EXPIRED_PROMOTION_CHECKS, (f"-{max_age_seconds} seconds",))
+            deleted_count = max(cursor.rowcount, 0)
+            logger.debug("Deleted %s expired promotion check results from the cache.", deleted_count)
+            return deleted_count
+        except sqlite3.Error as e:
+            logger.error(f"Database error deleting expired promotion check results: {e}", exc_info=True)
+            return 0
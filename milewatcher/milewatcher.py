@@ -1,12 +1,13 @@
 import logging
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
-from milewatcher.common.logger import AppLogger
+from milewatcher.analyzer import MileagePromotionChecker
+from milewatcher.common.logger import configure_logging
 from milewatcher.database.database_manager import DatabaseManager
 from milewatcher.scraper.sources.passageiro_de_primeira import PassageiroDePrimeiraScraper
 
-# Configure the logger for the application
-logger = AppLogger.get_logger(__name__)
+logger = logging.getLogger(__name__)
 
 class MileWatcher:
     """
@@ -14,41 +15,86 @@ class MileWatcher:
     promotion posts from various sources.
     """
 
+    # Number of post state updates accumulated before they are written to the database
+    _STATE_UPDATE_BATCH_SIZE = 500
+
+    # Maximum number of sources whose posts are extracted at the same time
+    _MAX_CONCURRENT_SOURCES = 8
+
+    # Maximum number of post batches analyzed at the same time
+    _MAX_CONCURRENT_ANALYSES = 8
+
+    # Number of posts analyzed in a single Gemini request
+    _ANALYSIS_BATCH_SIZE = 5
+
+    # Number of runs in which a post's analysis may fail before the post is set to ERROR
+    _MAX_ANALYSIS_ATTEMPTS = 3
+
     def __init__(self):
         """
         Initializes the MileWatcher application.
         """
+        configure_logging()
         self._db_manager = DatabaseManager()
+        # A single checker is shared by all posts; its results are cached in the database
+        self._promotion_checker = MileagePromotionChecker(self._db_manager)
         self._scrapers = [PassageiroDePrimeiraScraper()]
-        logger.info(f"MileWatcher initialized with {len(self._scrapers)} scraper(s)")
+        # Source IDs are resolved once and shared by both phases
+        self._source_ids = self._resolve_source_ids()
+        logger.info("MileWatcher initialized with %s scraper(s)", len(self._scrapers))
 
-    def run_post_extraction_phase(self):
+    def _resolve_source_ids(self) -> dict[str, int]:
         """
-        Executes the post extraction phase for all sources.
+        Gets or creates the database ID of every configured source.
+        Returns a dictionary mapping each source name to its ID. Sources whose
+        ID could not be resolved are left out, so both phases skip them.
         """
+        source_ids = {}
         for scraper in self._scrapers:
-            logger.info("-" * 50) # Horizontal line
-
             source_name = scraper.source_name
-            logger.info(f"Starting post extraction for source: {source_name}")
-
             source_id = self._db_manager.get_or_create_source_id(source_name)
 
             if source_id == -1:
                 logger.critical(f"Failed to get or create source ID for {source_name}")
                 continue
 
-            try:
-                found_posts = scraper.extract_posts()
+            source_ids[source_name] = source_id
+        return source_ids
+
+    def run_post_extraction_phase(self):
+        """
+        Executes the post extraction phase for all sources.
+        """
+        # Sources are scraped concurrently since each one is bound by its own host;
+        # database writes stay on this thread.
+        max_workers = max(1, min(self._MAX_CONCURRENT_SOURCES, len(self._scrapers)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for scraper in self._scrapers:
+                source_name = scraper.source_name
+                source_id = self._source_ids.get(source_name)
+                if source_id is None:
+                    continue
+
+                logger.info("Starting post extraction for source: %s", source_name)
+
+                futures[executor.submit(scraper.extract_posts)] = (source_name, source_id)
+
+            for future in as_completed(futures):
+                logger.info("-" * 50) # Horizontal line
 
-                if found_posts:
-                    logger.info(f"Extracted {len(found_posts)} posts")
-                    posts_inserted = self._db_manager.insert_posts(source_id, found_posts)
-                    logger.info(f"Inserted {posts_inserted} new posts to the database")
-                else:
-                    logger.warning(f"No posts found from {source_name}")
-            except Exception as e:
-                logger.error(f"Error during post extraction for {source_name}: {e}", exc_info=True)
+                source_name, source_id = futures[future]
+                try:
+                    found_posts = future.result()
+
+                    if found_posts:
+                        logger.info("Extracted %s posts from %s", len(found_posts), source_name)
+                        posts_inserted = self._db_manager.insert_posts(source_id, found_posts)
+                        logger.info("Inserted %s new posts from %s to the database", posts_inserted, source_name)
+                    else:
+                        logger.warning(f"No posts found from {source_name}")
+                except Exception as e:
+                    logger.error(f"Error during post extraction for {source_name}: {e}", exc_info=True)
 
         logger.info("Post extraction completed for all sources")
 
@@ -60,61 +106,148 @@ class MileWatcher:
             logger.info("-" * 50) # Horizontal line
 
             source_name = scraper.source_name
-            logger.info(f"Starting content extraction and analysis for source: {source_name}")
-
-            source_id = self._db_manager.get_or_create_source_id(source_name)
-            if source_id == -1:
-                logger.critical(f"Failed to get or create source ID for {source_name}")
+            source_id = self._source_ids.get(source_name)
+            if source_id is None:
                 continue
 
-            # Get posts that need content processing
-            posts_for_processing = self._db_manager.get_posts_for_content_processing(source_id)
+            logger.info("Starting content extraction and analysis for source: %s", source_name)
+
+            state_updates = []
+            found_count = 0
+            # Posts that need content processing are streamed from the database into the
+            # scraper, which fetches them concurrently and hands back each one as it is done.
+            # Several posts are analyzed per Gemini request, and each batch is sent as soon
+            # as it is full, so analysis overlaps the remaining extractions. Gemini requests
+            # are network-bound, so they run concurrently; database writes stay on this thread.
+            with ThreadPoolExecutor(max_workers=self._MAX_CONCURRENT_ANALYSES) as executor:
+                futures = {}
+                batch = []
+                posts = self._db_manager.iter_posts_for_content_processing(source_id)
+                for post_id, post_url, extracted_content in scraper.extract_post_contents(posts):
+                    found_count += 1
+                    logger.debug("Processed content for post ID: %s, URL: %s", post_id, post_url)
 
-            if not posts_for_processing:
-                logger.info(f"No posts found that require content analysis")
-                continue
+                    if extracted_content:
+                        batch.append((post_id, post_url, extracted_content))
+                    else:
+                        self._add_state_update(state_updates, post_id, post_url, DatabaseManager.PostState.ERROR)
 
-            logger.info(f"Found {len(posts_for_processing)} posts requiring content analysis.")
+                    if len(batch) >= self._ANALYSIS_BATCH_SIZE:
+                        # Waiting for queued batches keeps the number of article texts in memory bounded
+                        self._apply_analysis_results(futures, state_updates, max_pending=2 * self._MAX_CONCURRENT_ANALYSES - 1)
+                        futures[executor.submit(self._analyze_contents, [content for _, _, content in batch])] = batch
+                        batch = []
+                    else:
+                        self._apply_analysis_results(futures, state_updates, max_pending=len(futures))
 
-            for post in posts_for_processing:
-                post_id = post['id']
-                post_url = post['link']
+                if batch:
+                    futures[executor.submit(self._analyze_contents, [content for _, _, content in batch])] = batch
+                self._apply_analysis_results(futures, state_updates)
 
-                logger.debug(f"Processing content for post ID: {post_id}, URL: {post_url}")
+            if not found_count:
+                logger.info("No posts found that require content analysis")
+                continue
 
-                extracted_content = None
-                content_state = DatabaseManager.PostState.UNPROCESSED
+            logger.info("Processed %s posts requiring content analysis.", found_count)
+            self._flush_state_updates(state_updates)
 
-                try:
-                    # Extract the full content from the post's URL
-                    extracted_content = scraper.extract_post_content(post_url)
+        logger.info("Content analysis completed for all sources")
 
-                    if extracted_content:
-                        # TODO: Implement actual relevance analysis logic here
-                        # For now, kept as False, as per the original.
-                        content_state = DatabaseManager.PostState.NOT_RELEVANT
-                    else:
-                        content_state = DatabaseManager.PostState.ERROR
-                        logger.error(f"Could not extract content from URL: {post_url}")
+    def _apply_analysis_results(self, futures: dict, state_updates: list, max_pending: int = 0):
+        """
+        Queues the state of the posts of every finished analysis, removing it from 'futures'
+        (which maps each analysis to its batch of posts), and waits for running analyses
+        until at most 'max_pending' are left.
+        """
+        while True:
+            for future in [future for future in futures if future.done()]:
+                batch = futures.pop(future)
+                for (post_id, post_url, _), content_state in zip(batch, future.result()):
+                    self._add_state_update(state_updates, post_id, post_url, content_state)
 
-                except Exception as e:
-                    content_state = DatabaseManager.PostState.ERROR
-                    logger.error(f"Something went wrong during content extraction & analysis: {e}", exc_info=True)
+            if len(futures) <= max_pending:
+                return
+            wait(futures, return_when=FIRST_COMPLETED)
 
-                # Update the database with relevance status
-                self._db_manager.update_post_state(post_id, content_state)
-                logger.info(f"Database updated for URL ({post_url}) with state: {content_state}.")
+    def _analyze_contents(self, contents: list[str]) -> list[DatabaseManager.PostState | None]:
+        """
+        Checks a batch of post contents for the promotion with a single Gemini request.
+        Posts whose analysis failed, because the request raised or they are missing from
+        the response, are checked again one by one, so a single bad post doesn't fail
+        the whole batch.
+        Returns the resulting state for each post, in the same order, or None for posts
+        whose analysis still failed.
+        """
+        try:
+            results = self._promotion_checker.check_promotions(contents)
+        except Exception as e:
+            logger.error(f"Something went wrong during content analysis: {e}", exc_info=True)
+            results = [None] * len(contents)
+
+        content_states = []
+        for result in results:
+            if result is None:
+                content_states.append(None)
+            elif result[0]:
+                content_states.append(DatabaseManager.PostState.RELEVANT)
+            else:
+                content_states.append(DatabaseManager.PostState.NOT_RELEVANT)
+
+        if len(contents) > 1 and None in content_states:
+            logger.info("Checking %s posts of a batch one by one.", content_states.count(None))
+            content_states = [
+                content_state if content_state is not None else self._analyze_contents([content])[0]
+                for content, content_state in zip(contents, content_states)
+            ]
+        return content_states
+
+    def _add_state_update(self, state_updates: list, post_id: int, post_url: str, content_state: DatabaseManager.PostState | None):
+        """
+        Queues the state of an analyzed post, writing the queue to the database once it is full.
+        A None state records a failed analysis.
+        """
+        if content_state is None:
+            logger.warning("Content analysis failed for URL (%s).", post_url)
+        else:
+            logger.info("Content analysis finished for URL (%s) with state: %s.", post_url, content_state)
+        state_updates.append((post_id, content_state))
 
-        logger.info("Content analysis completed for all sources")
+        # Update the database with relevance status in batches
+        if len(state_updates) >= self._STATE_UPDATE_BATCH_SIZE:
+            self._flush_state_updates(state_updates)
+
+    def _flush_state_updates(self, state_updates: list):
+        """
+        Writes the accumulated post state updates to the database and clears the list.
+        Failed analyses are counted; a post is set to ERROR once it reaches the maximum
+        number of attempts and is otherwise analyzed again on the next run.
+        """
+        if not state_updates:
+            return
+        updates = [(post_id, state) for post_id, state in state_updates if state is not None]
+        failed_post_ids = [post_id for post_id, state in state_updates if state is None]
+        state_updates.clear()
+
+        if updates:
+            updated_count = self._db_manager.update_posts_state(updates)
+            logger.info("Database updated with the state of %s posts.", updated_count)
+        if failed_post_ids:
+            given_up_count = self._db_manager.record_failed_analyses(failed_post_ids, self._MAX_ANALYSIS_ATTEMPTS)
+            logger.warning("Content analysis failed for %s posts, %s of them after %s attempts and set to ERROR.",
+                           len(failed_post_ids), given_up_count, self._MAX_ANALYSIS_ATTEMPTS)
 
     def run(self):
         """
         Executes all phases of the scraping and analysis process.
         """
         logger.info("Application started.")
-        logger.info(f"Configured {len(self._scrapers)} scraper(s) to run.")
+        logger.info("Configured %s scraper(s) to run.", len(self._scrapers))
+
+        try:
+            self.run_post_extraction_phase()
+            self.run_content_analysis_phase()
+        finally:
+            for scraper in self._scrapers:
+                scraper.close()
 
-        self.run_post_extraction_phase()
-        self.run_content_analysis_phase()
-        
         logger.info("All scrapers processed. Application finished.")
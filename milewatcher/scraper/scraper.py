@@ -1,11 +1,71 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import lxml.html
+from lxml import etree
 from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import os
+import threading
+import time
+import types
 from urllib.parse import urlparse
 
+from milewatcher.common.file_config_manager import FileConfigManager
+
 logger = logging.getLogger(__name__)
 
+# Headers sent with every request, shared read-only by all scrapers
+_DEFAULT_HEADERS = types.MappingProxyType({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml',
+    # Brotli responses are decoded by urllib3 through the 'brotli' package
+    'Accept-Encoding': 'gzip, br, deflate'
+})
+
+class _DomainRateLimiter:
+    """
+    Limits the requests made to each host: at most 'max_concurrent' at the same time,
+    and at least 'min_interval' seconds between the start of two consecutive requests.
+    """
+
+    def __init__(self, max_concurrent: int, min_interval: float):
+        self._max_concurrent = max_concurrent
+        self._min_interval = min_interval
+        # Per host: (semaphore bounding concurrent requests, lock, [next allowed start time])
+        self._hosts: dict[str, tuple[threading.BoundedSemaphore, threading.Lock, list[float]]] = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_state(self, host: str) -> tuple[threading.BoundedSemaphore, threading.Lock, list[float]]:
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = (threading.BoundedSemaphore(self._max_concurrent), threading.Lock(), [0.0])
+            return self._hosts[host]
+
+    @contextmanager
+    def limit(self, target_url: str):
+        """
+        Waits until a request to the host of the given URL is allowed, and holds its
+        slot until the block exits.
+        """
+        semaphore, lock, next_start = self._host_state(urlparse(target_url).netloc)
+        with semaphore:
+            # Each request reserves its start time, so concurrent callers are spaced out
+            with lock:
+                now = time.monotonic()
+                start = max(now, next_start[0])
+                next_start[0] = start + self._min_interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
 class Scraper(ABC):
     """
     Abstract class defining the contract for a scraper.
@@ -13,21 +73,93 @@ class Scraper(ABC):
     and implement the 'extract_posts' and 'extract_post_content' methods.
     """
 
-    def __init__(self, url: str, source_name: str):
+    # Instances hold no per-instance __dict__; subclasses should declare their own __slots__
+    __slots__ = ('_url', '_source_name', 'headers', '_owns_session', '_session', 'logger')
+
+    # (connect, read) timeouts in seconds: unreachable hosts are given up on quickly,
+    # while slow but responsive ones still get time to send the page
+    _REQUEST_TIMEOUT = (3.05, 10)
+
+    # Size of the chunks read from streamed HTTP responses
+    _STREAM_CHUNK_SIZE = 8192
+
+    # Directory, inside the configuration directory, where pages fetched with
+    # conditional requests are kept between runs
+    _PAGE_CACHE_DIR = 'page_cache'
+
+    # Maximum number of post contents extracted at the same time by a scraper
+    _MAX_CONCURRENT_EXTRACTIONS = 8
+
+    # Maximum number of pages fetched from the same host at the same time, across all scrapers
+    _MAX_CONCURRENT_REQUESTS_PER_HOST = 8
+
+    # Minimum time, in seconds, between the start of two requests to the same host
+    _MIN_REQUEST_INTERVAL_PER_HOST = 0.1
+
+    # Shared by all scrapers, so sources on the same host are limited together
+    _rate_limiter = _DomainRateLimiter(_MAX_CONCURRENT_REQUESTS_PER_HOST, _MIN_REQUEST_INTERVAL_PER_HOST)
+
+    def __init__(self, url: str, source_name: str, session: requests.Session = None):
         self._url = url
         self._source_name = source_name
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        self.headers = _DEFAULT_HEADERS
+        # A shared session keeps connections to the source alive between requests,
+        # so only the first request to a host pays for the TCP/TLS handshake.
+        # A session given by the caller is left open by close(); it belongs to the caller.
+        self._owns_session = session is None
+        self._session = session if session is not None else self._create_session()
+        if self._owns_session:
+            self._session.headers.update(self.headers)
         self.logger = logging.getLogger(self.__class__.__name__)
-        logger.debug(f"Scraper initialized for {self.source_name}")
+        logger.debug("Scraper initialized for %s", self.source_name)
 
 
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """
+        Creates an HTTP session with a connection pool and automatic retries.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                connect=2,
+                read=1,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=['GET']
+            )
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        """
+        Closes the HTTP session, releasing its pooled connections.
+        """
+        if self._owns_session:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     @property
     def source_name(self) -> str:
         """Read-only property for the source's name."""
         return self._source_name
 
+    @property
+    def base_url(self) -> str:
+        """Read-only property for the source's base URL (scheme and host), e.g. 'https://example.com/'."""
+        parsed_url = urlparse(self._url)
+        return f"{parsed_url.scheme}://{parsed_url.netloc}/"
+
     @abstractmethod
     def extract_posts(self) -> list[dict]:
         """
@@ -47,18 +179,217 @@ class Scraper(ABC):
         """
         pass
 
-    def _fetch_html_from_url(self, target_url: str) -> BeautifulSoup | None:
+    def extract_post_contents(self, posts: Iterable[tuple[int, str]]) -> Iterator[tuple[int, str, str | None]]:
         """
-        Helper method to make the HTTP request and parse the HTML from a given URL.
+        Extracts the contents of several posts concurrently, since each extraction is
+        bound by network latency.
+
+        'posts' yields (post_id, post_url) pairs and is consumed lazily: only a bounded
+        number of extractions are queued ahead of the running ones, so the posts can be
+        streamed straight from the database.
+
+        Yields (post_id, post_url, content) tuples as soon as each extraction finishes,
+        not in the given order. The content is None if it could not be extracted.
+        """
+        posts = iter(posts)
+        with ThreadPoolExecutor(max_workers=self._MAX_CONCURRENT_EXTRACTIONS) as executor:
+            futures = {}
+            while True:
+                # Keep the pool busy, with one extraction queued behind each running one
+                for post_id, post_url in itertools.islice(posts, 2 * self._MAX_CONCURRENT_EXTRACTIONS - len(futures)):
+                    futures[executor.submit(self.extract_post_content, post_url)] = (post_id, post_url)
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    post_id, post_url = futures.pop(future)
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        self.logger.error("Something went wrong during content extraction from %s: %s", post_url, e, exc_info=True)
+                        content = None
+                    else:
+                        if not content:
+                            self.logger.error("Could not extract content from URL: %s", post_url)
+                            content = None
+                    yield post_id, post_url, content
+
+    def _request_url(self, target_url: str, stream: bool = False, headers: dict = None) -> requests.Response | None:
         """
-        self.logger.debug(f"Accessing URL: {target_url}")
+        Helper method to make the HTTP request to a given URL.
+        With 'stream' set, the body is only downloaded as it is consumed.
+        'headers' are sent in addition to the session ones.
+        Returns the response, or None if the request failed.
+        """
+        self.logger.debug("Accessing URL: %s", target_url)
+        if not self._owns_session:
+            # The caller's session is left untouched, so the scraper headers go with each request
+            headers = {**self.headers, **(headers or {})}
         try:
-            response = requests.get(target_url, headers=self.headers, timeout=15)
+            response = self._session.get(target_url, timeout=self._REQUEST_TIMEOUT, stream=stream, headers=headers)
             response.raise_for_status()
-            return BeautifulSoup(response.text, 'html.parser')
+            return response
         except requests.exceptions.RequestException as e:
             self.logger.error(f"HTTP request error for {target_url}: {e}", exc_info=True)
             return None
-        except Exception as e:
-            self.logger.critical(f"An unexpected error occurred during HTML fetch from {target_url}: {e}", exc_info=True)
+
+    @staticmethod
+    def _declared_encoding(response: requests.Response) -> str | None:
+        """
+        Returns the charset explicitly declared in the response's Content-Type header, if any.
+        """
+        if 'charset' not in response.headers.get('Content-Type', '').lower():
+            # requests would otherwise fall back to ISO-8859-1 for any text/* response
             return None
+        return requests.utils.get_encoding_from_headers(response.headers)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _page_cache_dir(cls) -> str:
+        """
+        Returns the directory of the page cache, resolved and created only once.
+        """
+        return os.path.dirname(FileConfigManager().get_file_path(os.path.join(cls._PAGE_CACHE_DIR, '')))
+
+    def _cached_page_path(self, target_url: str) -> str:
+        """
+        Returns the path of the file caching the page at the given URL.
+        """
+        file_name = hashlib.sha1(target_url.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self._page_cache_dir(), file_name)
+
+    def _load_cached_page(self, target_url: str) -> dict | None:
+        """
+        Returns the cached copy of a page, with its 'etag', 'last_modified' and
+        'document' entries, or None if the page is not cached or its copy is incomplete.
+        """
+        try:
+            with open(self._cached_page_path(target_url), encoding='utf-8') as cache_file:
+                cached_page = json.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable cached copy of {target_url}: {e}")
+            return None
+
+        # A copy that can't be served on '304 Not Modified' is no use for a conditional request
+        if (not isinstance(cached_page, dict)
+                or not isinstance(cached_page.get('document'), str)
+                or not all(isinstance(cached_page.get(key), (str, type(None))) for key in ('etag', 'last_modified'))
+                or not (cached_page.get('etag') or cached_page.get('last_modified'))):
+            self.logger.warning(f"Ignoring incomplete cached copy of {target_url}")
+            return None
+        return cached_page
+
+    def _store_cached_page(self, target_url: str, response: requests.Response, document: lxml.html.HtmlElement):
+        """
+        Caches a parsed page together with the validators sent by the server, if there are any.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+
+        cached_page = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'document': lxml.html.tostring(document, encoding='unicode')
+        }
+        cache_path = self._cached_page_path(target_url)
+        try:
+            # Written to a temporary file first, so a reader never sees a partial copy
+            with open(f"{cache_path}.tmp", 'w', encoding='utf-8') as cache_file:
+                json.dump(cached_page, cache_file)
+            os.replace(f"{cache_path}.tmp", cache_path)
+        except OSError as e:
+            self.logger.warning(f"Could not cache {target_url}: {e}")
+
+    @staticmethod
+    def _validator_headers(cached_page: dict | None) -> dict | None:
+        """
+        Returns the headers making a request conditional on the page having changed
+        since it was cached, or None if there is no cached copy.
+        """
+        if not cached_page:
+            return None
+        headers = {}
+        if cached_page.get('etag'):
+            headers['If-None-Match'] = cached_page['etag']
+        if cached_page.get('last_modified'):
+            headers['If-Modified-Since'] = cached_page['last_modified']
+        return headers
+
+    def _fetch_document_from_url(self, target_url: str, stop_after_tag: str = None,
+                                 stop_after: Callable[[lxml.html.HtmlElement], bool] = None,
+                                 conditional: bool = False) -> lxml.html.HtmlElement | None:
+        """
+        Helper method to make the HTTP request and parse the HTML from a given URL
+        straight into an lxml tree.
+
+        The body is streamed into an incremental parser. When 'stop_after_tag' is given,
+        downloading and parsing stop as soon as an element with that tag is closed and
+        matches the optional 'stop_after' predicate, so the rest of the page (comments,
+        footers, etc.) is never transferred. The returned tree then ends at that element.
+
+        If reading or parsing the stream fails midway, the page is downloaded again
+        in full and parsed in one go.
+
+        With 'conditional' set, the parsed page is cached between runs along with its
+        ETag/Last-Modified validators, and later requests ask the server to only send
+        the page if it has changed. On '304 Not Modified' the cached copy is returned.
+        """
+        cached_page = self._load_cached_page(target_url) if conditional else None
+
+        # The host's slot is held until the streamed body has been read
+        with self._rate_limiter.limit(target_url):
+            response = self._request_url(target_url, stream=True, headers=self._validator_headers(cached_page))
+            if response is None:
+                return None
+
+            if cached_page and response.status_code == 304:
+                response.close()
+                self.logger.debug("%s not modified, using the cached copy.", target_url)
+                return lxml.html.document_fromstring(cached_page['document'])
+
+            try:
+                with response:
+                    # Without an explicit charset, lxml uses the one declared in the document's <meta> tag
+                    parser = etree.HTMLPullParser(
+                        events=('end',),
+                        tag=stop_after_tag,
+                        encoding=self._declared_encoding(response)
+                    )
+                    parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+
+                    for chunk in response.iter_content(chunk_size=self._STREAM_CHUNK_SIZE):
+                        parser.feed(chunk)
+                        if stop_after_tag and any(stop_after is None or stop_after(element)
+                                                  for _, element in parser.read_events()):
+                            self.logger.debug("Found <%s> in %s, skipping the rest of the page.", stop_after_tag, target_url)
+                            break
+                    document = parser.close()
+
+                if conditional:
+                    self._store_cached_page(target_url, response, document)
+                return document
+            except (requests.exceptions.RequestException, etree.LxmlError) as e:
+                self.logger.warning(f"Streamed parsing of {target_url} failed ({e}), falling back to a full download.")
+            except Exception as e:
+                self.logger.critical(f"An unexpected error occurred during HTML fetch from {target_url}: {e}", exc_info=True)
+                return None
+
+        with self._rate_limiter.limit(target_url):
+            response = self._request_url(target_url)
+            if response is None:
+                return None
+            try:
+                parser = lxml.html.HTMLParser(encoding=self._declared_encoding(response))
+                document = lxml.html.document_fromstring(response.content, parser=parser)
+
+                if conditional:
+                    self._store_cached_page(target_url, response, document)
+                return document
+            except Exception as e:
+                self.logger.critical(f"An unexpected error occurred during HTML fetch from {target_url}: {e}", exc_info=True)
+                return None
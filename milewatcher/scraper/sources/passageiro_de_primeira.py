@@ -1,19 +1,35 @@
 import logging
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from urllib.parse import urljoin
 from ..scraper import Scraper
 
 logger = logging.getLogger(__name__)
 
+# Prefixes of links that are already absolute
+_ABS_PREFIXES = ('http://', 'https://')
+
 class PassageiroDePrimeiraScraper(Scraper):
     """
     Concrete implementation of Scraper for the Passageiro de Primeira website.
     Defines the specific logic to extract posts from the promotions section.
     """
-    def __init__(self):
+
+    __slots__ = ()
+
+    # Equivalent to the CSS selector 'div[data-term="promocoes"]', compiled once
+    _PROMOTIONS_SECTION_XPATH = etree.XPath("//div[@data-term='promocoes']")
+
+    # Equivalent to the CSS selector 'article.single-content', compiled once
+    _ARTICLE_XPATH = etree.XPath(
+        "//article[contains(concat(' ', normalize-space(@class), ' '), ' single-content ')]"
+    )
+
+    def __init__(self, session: requests.Session = None):
         super().__init__(
             url='https://passageirodeprimeira.com/categorias/promocoes/',
-            source_name="Passageiro de Primeira"
+            source_name="Passageiro de Primeira",
+            session=session
         )
 
     def extract_posts(self) -> list[dict]:
@@ -23,41 +39,55 @@ class PassageiroDePrimeiraScraper(Scraper):
 
         self.logger.debug("Starting post extraction for Passageiro de Primeira.")
 
-        soup = self._fetch_html_from_url(self._url)
-        if not soup:
+        # Only the promotions section is needed; stop reading the page once it is complete
+        document = self._fetch_document_from_url(
+            self._url,
+            stop_after_tag='div',
+            stop_after=lambda element: element.get('data-term') == 'promocoes',
+            conditional=True
+        )
+        if document is None:
             self.logger.error("Failed to fetch HTML content. Cannot extract posts.")
             return []
 
-        promotions_section = soup.find('div', {'data-term': 'promocoes'})
+        promotions_sections = self._PROMOTIONS_SECTION_XPATH(document)
 
-        if not promotions_section:
+        if not promotions_sections:
             self.logger.error("Section 'promocoes' (data-term=\"promocoes\") not found in HTML. Please check the page structure.")
             return []
 
         self.logger.debug("Section 'promocoes' found. Searching for posts...")
 
-        h1_titles = promotions_section.find_all('h1', class_='article--title')
-
-        if not h1_titles:
-            self.error.warning("No <h1 class=\"article--title\"> elements found. Please check the page structure.")
-            return []
-
         posts = []
-        for h1_tag in h1_titles:
-            link_tag = h1_tag.find('a', href=True)
-
-            if link_tag:
+        seen_links = set() # The same promotion may be listed more than once
+        base_url = self.base_url # Looked up once instead of on every title
+        titles_found = False
+        # Titles are matched while walking the section, without building a list of them first
+        for h1_tag in promotions_sections[0].iter('h1'):
+            if 'article--title' not in h1_tag.classes:
+                continue
+            titles_found = True
+
+            link_tag = next(h1_tag.iterfind('.//a[@href]'), None)
+
+            if link_tag is not None:
                 link = link_tag.get('href')
-                title = link_tag.get_text(strip=True)
+                title = ''.join(text.strip() for text in link_tag.itertext())
 
-                # Use self.base_url from the parent class (now inferred)
-                if link and not link.startswith(('http://', 'https://')):
-                    link = self.base_url + link
+                # Relative links are resolved against the source's base URL
+                if link and not link.startswith(_ABS_PREFIXES):
+                    link = urljoin(base_url, link)
 
-                if title and title.strip() != '':
+                # The title is built from stripped text, so it is only empty if there is no text
+                if title and link and link not in seen_links:
+                    seen_links.add(link)
                     posts.append({'title': title, 'link': link})
 
-        self.logger.debug(f"Finished extraction for Passageiro de Primeira. Found {len(posts)} posts.")
+        if not titles_found:
+            self.logger.warning("No <h1 class=\"article--title\"> elements found. Please check the page structure.")
+            return []
+
+        self.logger.debug("Finished extraction for Passageiro de Primeira. Found %s posts.", len(posts))
 
         return posts
 
@@ -66,19 +96,28 @@ class PassageiroDePrimeiraScraper(Scraper):
         Extracts the main textual content from a single post URL on Passageiro de Primeira.
         Assumes the main content is within a <div> with class 'single-content'.
         """
-        self.logger.debug(f"Extracting content from post URL: {post_url}")
-        soup = self._fetch_html_from_url(post_url) # Uses the new helper for specific post URL
-        if not soup:
+        self.logger.debug("Extracting content from post URL: %s", post_url)
+        # Stop reading the page once the article is complete, skipping comments and footers
+        document = self._fetch_document_from_url(
+            post_url,
+            stop_after_tag='article',
+            stop_after=lambda element: 'single-content' in element.classes
+        )
+        if document is None:
             self.logger.error(f"Failed to fetch HTML content for post URL: {post_url}. Cannot extract content.")
             return ""
 
         # Based on inspection, the main article content is often within an article with class 'single-content'
-        article_tag = soup.find('article', class_='single-content')
-
-        if article_tag:
-            # Get all text, strip extra whitespace, and join paragraphs with newlines
-            content_text = article_tag.get_text(separator='\n', strip=True)
-            self.logger.debug(f"Successfully extracted content from {post_url} (length: {len(content_text)}).")
+        article_tags = self._ARTICLE_XPATH(document)
+
+        if article_tags:
+            article_tag = article_tags[0]
+            # Drop embedded scripts/styles, which are not part of the readable text
+            etree.strip_elements(article_tag, 'script', 'style', with_tail=False)
+            # Get all text, strip extra whitespace, and join paragraphs with newlines.
+            # Each piece is stripped only once, and blank ones are dropped, without Python-level loops.
+            content_text = '\n'.join(filter(None, map(str.strip, article_tag.itertext())))
+            self.logger.debug("Successfully extracted content from %s (length: %s).", post_url, len(content_text))
             return content_text
         else:
             self.logger.warning(f"Could not find main article (class 'single-content') for {post_url}.")
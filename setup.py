@@ -18,6 +18,8 @@ setup(
     python_requires='>=3.9',
     install_requires=[
         'requests',
-        'beautifulsoup4',
+        'lxml',
+        'brotli',
+        'google-generativeai',
     ],
 )